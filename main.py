@@ -1,25 +1,27 @@
 import asyncio
 import contextlib
-import io
-import json
+import hashlib
 import logging
 import os
 import re
+import tempfile
 import time
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any
+from pathlib import Path
+from typing import Any, Final
 
-import pandas as pd
-from aiogram import Bot, Dispatcher, Router
+import orjson
+from aiogram import Bot, Dispatcher, F, Router
 from aiogram.enums import ChatMemberStatus, ChatType
 from aiogram.exceptions import AiogramError, TelegramBadRequest
 from aiogram.filters import Command, Filter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (
-    BufferedInputFile,
     CallbackQuery,
+    ChatMemberUpdated,
+    FSInputFile,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     Message,
@@ -27,7 +29,9 @@ from aiogram.types import (
     Update
 )
 from dotenv import load_dotenv
-from openpyxl.styles import Alignment
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
 from openpyxl.utils import get_column_letter
 
 from scheduler import Scheduler
@@ -61,7 +65,6 @@ class Config:
 
     @classmethod
     def from_env(cls) -> 'Config':
-        load_dotenv()
         token = os.getenv('TOKEN', '')
         if not token or token == 'token':
             raise RuntimeError('Environment variable TOKEN is invalid.')
@@ -101,13 +104,24 @@ logger = logging.getLogger(__name__)
 NAME_REGEX = re.compile(r'^[А-Яа-яЁё-]+$')
 DISCIPLINE_QUOTE = re.compile(r'"([^"]+)"')
 
+# ----- Report -----
+MARK_MAP = {0: 'Д', 1: 'Н', 2: 'П', 3: 'Б', 4: 'НМГ'}  # poll option index -> attendance mark
+REPORT_FORMAT_VERSION = 2  # bump on any change to _render_xlsx output, invalidates cached reports
+REPORT_CELL_STYLE = 'centered'
+REPORT_HEADER_STYLE = 'header'
+EXCEL_INJECTION_PREFIXES = frozenset('=+-@')
+REPORT_CELL_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+REPORT_HEADER_BORDER = Border(
+    left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin')
+)
+
 
 def is_valid_name(name: str) -> bool:
     return bool(NAME_REGEX.fullmatch(name.strip()))
 
 
 def extract_quoted(text: str) -> list[str]:
-    return re.findall(r'"([^"]+)"', text)
+    return DISCIPLINE_QUOTE.findall(text)
 
 
 async def is_valid_chat_type(bot: Bot, config: Config) -> None:
@@ -124,23 +138,39 @@ async def is_valid_chat_type(bot: Bot, config: Config) -> None:
 
 
 class UserInGroupFilter(Filter):
+    CACHE_TTL: Final[float] = 300.0
+
     def __init__(self, bot: Bot, chat_id: int):
         self.bot = bot
         self.chat_id = chat_id
+        self._cache: dict[int, float] = {}  # user_id -> checked_at, members only
 
     async def __call__(self, message: Message) -> bool:
+        user_id = message.from_user.id
+        checked_at = self._cache.get(user_id)
+        if checked_at and time.monotonic() - checked_at < self.CACHE_TTL:
+            return True
+
         try:
-            member = await self.bot.get_chat_member(self.chat_id, message.from_user.id)
+            member = await self.bot.get_chat_member(self.chat_id, user_id)
         except TelegramBadRequest as e:
             logging.error(f'Error when fetching chat member info: {e}')
             return False
 
-        return member.status in {
+        is_member = member.status in {
             ChatMemberStatus.CREATOR,
             ChatMemberStatus.ADMINISTRATOR,
             ChatMemberStatus.MEMBER,
             ChatMemberStatus.RESTRICTED,
         }
+        # non-members aren't cached: someone who just joined must pass right away,
+        # chat_member updates that would invalidate the cache need bot admin rights
+        if is_member:
+            self._cache[user_id] = time.monotonic()
+        return is_member
+
+    def invalidate(self, user_id: int) -> None:
+        self._cache.pop(user_id, None)
 
 
 class PrivateChatFilter(Filter):
@@ -182,6 +212,10 @@ class ManageEmojiBanState(StatesGroup):
 
 # ----- Main Bot Class -----
 class AttendanceBot:
+    BOT_ADMIN_CACHE_TTL: Final[float] = 60.0
+    REPORT_CACHE_DIR: Final[Path] = Path('reports')
+    REPORT_CACHE_SIZE: Final[int] = 20
+
     def __init__(self, config: Config):
         self.config = config
         self.bot: Bot | None = None
@@ -189,9 +223,14 @@ class AttendanceBot:
         self.router = Router()
         self.storage = StorageManager()
         self.scheduler: Scheduler | None = None
+        self.group_filter: UserInGroupFilter | None = None
+
+        # chat_id -> (checked_at, is_admin)
+        self._bot_admin_cache: dict[int, tuple[float, bool]] = {}
+        self._reports_in_flight = 0
 
     def setup_routes(self) -> None:
-        group_filter = UserInGroupFilter(self.bot, self.config.chat_id)
+        group_filter = self.group_filter = UserInGroupFilter(self.bot, self.config.chat_id)
         dm_filter = PrivateChatFilter()
         admin_filter = AdminFilter(self.config.admin_ids)
 
@@ -207,7 +246,7 @@ class AttendanceBot:
             group_filter,
             admin_filter
         )(self._on_manage_disciplines_menu)
-        self.router.callback_query(lambda c: c.data and c.data.startswith('md:'))(self._on_manage_discipline_cb)
+        self.router.callback_query(F.data.startswith('md:'))(self._on_manage_discipline_cb)
         self.router.message(ManageDisciplineState.full_class_name)(self._on_receive_full_class_name)
         self.router.message(ManageDisciplineState.alias)(self._on_receive_class_alias)
         self.router.message(ManageDisciplineState.class_type)(self._on_receive_class_type)
@@ -218,82 +257,138 @@ class AttendanceBot:
             group_filter,
             admin_filter
         )(self._on_manage_emoji_bans_menu)
-        self.router.callback_query(lambda c: c.data == 'eb:list')(self._on_show_banned_emojis_list)
-        self.router.callback_query(lambda c: c.data and c.data.startswith('eb:') and c.data != 'eb:list')(self._on_manage_emoji_ban_cb)
+        self.router.callback_query(F.data == 'eb:list')(self._on_show_banned_emojis_list)
+        self.router.callback_query(F.data.startswith('eb:') & (F.data != 'eb:list'))(self._on_manage_emoji_ban_cb)
         self.router.message(ManageEmojiBanState.emoji)(self._on_receive_emoji)
         self.router.message(Registration.last_name)(self._on_last_name)
         self.router.message(Registration.first_name)(self._on_first_name)
         # Message moderation - must be last to not interfere with commands
-        self.router.message(lambda m: m.chat.type in (ChatType.GROUP, ChatType.SUPERGROUP))(self._on_group_message)
+        self.router.message(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}), F.text)(self._on_group_message)
+        self.router.my_chat_member()(self._on_my_chat_member)
+        self.router.chat_member()(self._on_chat_member)
         self.router.poll_answer()(self._on_poll_answer)
         self.router.errors()(self._on_error)
 
-    async def _build_report(self, polls: list[dict[str, Any]], year: int, month: int) -> BufferedInputFile:
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:  # type: ignore
-            df = pd.DataFrame(polls)
-            for date_val, group in df.groupby('date'):
-                sheet_name = str(date_val).replace('.', '-')[:31]
-
-                label_to_time: dict[str, str] = {}
-                records: dict[str, dict[str, str]] = {}
-
-                for _, row in group.iterrows():
-                    cls_label = f'{row["class_name"]} ({row["start_time"]} - {row["end_time"]})'
-
-                    if cls_label in label_to_time:
-                        prof_last_name = row['prof'].split()[1]
-                        cls_label = f'{cls_label} ({prof_last_name})'
-
-                    label_to_time[cls_label] = row["start_time"]
-
-                    for resp in json.loads(row['responses']):
-                        user = await self.storage.get_user(resp['user_id']) or {}
-                        last_name = user.get('last_name', resp['last_name'])
-                        first_name = user.get('first_name', resp['first_name'])
-
-                        name = f'{last_name} {first_name}'
-                        opt = resp['option_ids'][0] if resp['option_ids'] else None
-                        mark = {0: 'Д', 1: 'Н', 2: 'П', 3: 'Б', 4: 'НМГ'}.get(opt, '')
-                        records.setdefault(name, {})[cls_label] = mark
-
-                classes_list = sorted(
-                    label_to_time.keys(),
-                    key=lambda lbl: datetime.strptime(label_to_time[lbl], "%H:%M")
-                )
-
-                table = []
-                for student_name, answers in records.items():
-                    safe_name = student_name
-                    if isinstance(student_name, str) and student_name[0] in ('=', '+', '-', '@'):
-                        safe_name = f"'{student_name}"  # excel injection protection
-
-                    row_dict = {'Имя': safe_name}
-                    for cls_label in classes_list:
-                        row_dict[cls_label] = answers.get(cls_label, '')
-                    table.append(row_dict)
-
-                df_day = pd.DataFrame(table, columns=['Имя'] + classes_list)
-                df_day = df_day.sort_values(by='Имя')
-                df_day.to_excel(writer, sheet_name=sheet_name, index=False)
-
-                ws = writer.sheets[sheet_name]
-                for idx, col in enumerate(df_day.columns, start=1):
-                    max_width = max(
-                        df_day[col].astype(str).map(len).max(),
-                        len(str(col))
-                    )
-                    adjusted_width = max_width + 3
-                    col_letter = get_column_letter(idx)
-                    ws.column_dimensions[col_letter].width = adjusted_width
-
-                align = Alignment(horizontal='center', vertical='center')
-                for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
-                    for cell in row:
-                        cell.alignment = align
-
-        output.seek(0)
-        return BufferedInputFile(output.getvalue(), filename=f'attendance_{year}-{month:02d}.xlsx')
+    async def _build_report(self, polls: list[dict[str, Any]], year: int, month: int) -> FSInputFile:
+        users = await self._gather_users(polls)
+
+        # same polls, answers and names -> same report, reuse the rendered file
+        fingerprint = hashlib.sha256(orjson.dumps(
+            [[poll['poll_id'], poll['responses']] for poll in polls] + sorted(users.items()),
+            option=orjson.OPT_SORT_KEYS
+        )).hexdigest()
+        path = self.REPORT_CACHE_DIR / f'{year}-{month:02d}-v{REPORT_FORMAT_VERSION}-{fingerprint}.xlsx'
+
+        if path.exists():
+            path.touch()  # mark as recently used
+        else:
+            # rendering is CPU-bound - keep the event loop free for other updates
+            await asyncio.to_thread(self._render_xlsx, polls, users, path)
+
+        return FSInputFile(path, filename=f'attendance_{year}-{month:02d}.xlsx')
+
+    def _evict_cached_reports(self) -> None:
+        reports = sorted(self.REPORT_CACHE_DIR.glob('*.xlsx'), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old_report in reports[self.REPORT_CACHE_SIZE:]:
+            with contextlib.suppress(OSError):
+                old_report.unlink()
+
+    async def _gather_users(self, polls: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+        user_ids: set[str] = set()
+        for poll in polls:
+            poll['_responses'] = orjson.loads(poll['responses'])
+            user_ids.update(resp['user_id'] for resp in poll['_responses'])
+
+        return await self.storage.get_users(user_ids)
+
+    @staticmethod
+    def _render_xlsx(
+            polls: list[dict[str, Any]],
+            users: dict[str, dict[str, Any]],
+            path: Path
+    ) -> None:
+        by_date: dict[str, list[dict[str, Any]]] = {}
+        for poll in polls:
+            by_date.setdefault(poll['date'], []).append(poll)
+
+        wb = Workbook(write_only=True)
+        wb.add_named_style(NamedStyle(REPORT_CELL_STYLE, alignment=REPORT_CELL_ALIGNMENT))
+        wb.add_named_style(NamedStyle(
+            REPORT_HEADER_STYLE,
+            font=Font(bold=True),
+            border=REPORT_HEADER_BORDER,
+            alignment=REPORT_CELL_ALIGNMENT
+        ))
+        for date_val, group in by_date.items():
+            sheet_name = str(date_val).replace('.', '-')[:31]
+
+            label_to_time: dict[str, str] = {}
+            records: dict[str, dict[str, str]] = {}
+
+            for row in group:
+                cls_label = f'{row["class_name"]} ({row["start_time"]} - {row["end_time"]})'
+
+                if cls_label in label_to_time:
+                    prof_last_name = row['prof'].split()[1]
+                    cls_label = f'{cls_label} ({prof_last_name})'
+
+                label_to_time[cls_label] = row["start_time"]
+
+                for resp in row['_responses']:
+                    user = users.get(resp['user_id'], {})
+                    last_name = user.get('last_name', resp['last_name'])
+                    first_name = user.get('first_name', resp['first_name'])
+
+                    name = f'{last_name} {first_name}'
+                    opt = resp['option_ids'][0] if resp['option_ids'] else None
+                    mark = MARK_MAP.get(opt, '')
+                    records.setdefault(name, {})[cls_label] = mark
+
+            # HH:MM strings sort chronologically as is
+            classes_list = sorted(label_to_time.keys(), key=label_to_time.get)
+            columns = ['Имя'] + classes_list
+
+            table = []
+            col_widths = [len(col) for col in columns]
+            for student_name, answers in records.items():
+                safe_name = student_name
+                if student_name[:1] in EXCEL_INJECTION_PREFIXES:
+                    safe_name = f"'{student_name}"  # excel injection protection
+
+                values = [safe_name] + [answers.get(cls_label, '') for cls_label in classes_list]
+                col_widths = [max(width, len(value)) for width, value in zip(col_widths, values)]
+                table.append(values)
+            table.sort(key=lambda r: r[0])
+
+            ws = wb.create_sheet(sheet_name)
+
+            # write-only sheets need column widths set before any rows are appended
+            for idx, width in enumerate(col_widths, start=1):
+                ws.column_dimensions[get_column_letter(idx)].width = width + 3
+
+            for style, rows in ((REPORT_HEADER_STYLE, [columns]), (REPORT_CELL_STYLE, table)):
+                for values in rows:
+                    cells = []
+                    for value in values:
+                        cell = WriteOnlyCell(ws, value=value)
+                        cell.style = style
+                        cells.append(cell)
+                    ws.append(cells)
+
+        # write next to the target and swap in, so a half-written file is never served from cache
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False) as tmp:
+            try:
+                wb.save(tmp)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        try:
+            os.replace(tmp.name, path)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
 
     # ----- Route Handlers -----
     async def _on_start(self, message: Message, state: FSMContext) -> None:
@@ -403,8 +498,15 @@ class AttendanceBot:
         if not polls:
             return await message.answer('Нет данных за этот период.')
 
-        file = await self._build_report(polls, year, month)
-        return await message.answer_document(file)
+        self._reports_in_flight += 1
+        try:
+            file = await self._build_report(polls, year, month)
+            return await message.answer_document(file)
+        finally:
+            self._reports_in_flight -= 1
+            # evict only when no other export may still be about to upload a cached file
+            if not self._reports_in_flight:
+                self._evict_cached_reports()
 
     async def _on_manage_disciplines_menu(self, message: Message) -> Message:
         kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -558,10 +660,8 @@ class AttendanceBot:
             return await message.answer('Сообщение не может быть пустым.')
 
         # Extract emojis from text (simple approach - any non-text characters)
-        emojis = []
-        for char in text:
-            if ord(char) > 127:  # Non-ASCII characters are likely emojis
-                emojis.append(char)
+        # Non-ASCII characters are likely emojis; dict.fromkeys drops duplicates keeping order
+        emojis = list(dict.fromkeys(char for char in text if not char.isascii()))
 
         if not emojis:
             return await message.answer('В сообщении не найдено смайликов. Попробуйте отправить смайлики.')
@@ -604,38 +704,53 @@ class AttendanceBot:
 
         await query.message.answer(text)
 
+    async def _is_bot_admin(self, chat_id: int) -> bool:
+        cached = self._bot_admin_cache.get(chat_id)
+        if cached and time.monotonic() - cached[0] < self.BOT_ADMIN_CACHE_TTL:
+            return cached[1]
+
+        try:
+            bot_member = await self.bot.get_chat_member(chat_id, self.bot.id)
+        except TelegramBadRequest:
+            logger.warning(f'Cannot check bot permissions in chat {chat_id}')
+            return False  # Can't check permissions, retry on next message
+
+        is_admin = bot_member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR)
+        if not is_admin:
+            logger.warning(f'Bot lacks admin rights in chat {chat_id}')
+
+        self._bot_admin_cache[chat_id] = (time.monotonic(), is_admin)
+        return is_admin
+
+    async def _on_my_chat_member(self, update: ChatMemberUpdated) -> None:
+        # Bot's own rights changed - drop cached admin status
+        self._bot_admin_cache.pop(update.chat.id, None)
+
+    async def _on_chat_member(self, update: ChatMemberUpdated) -> None:
+        # Membership changed - next command re-checks it
+        if update.chat.id == self.config.chat_id:
+            self.group_filter.invalidate(update.new_chat_member.user.id)
+
     async def _on_group_message(self, message: Message) -> None:
         # Skip if user is admin
         if message.from_user.id in self.config.admin_ids:
             return
 
-        # Skip if message has no text
-        if not message.text:
+        # Plain ASCII text can't contain emojis
+        if message.text.isascii():
             return
 
-        # Check if bot has admin rights in this chat
-        try:
-            bot_member = await self.bot.get_chat_member(message.chat.id, self.bot.id)
-            if not bot_member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR):
-                logger.warning(f'Bot lacks admin rights in chat {message.chat.id}')
-                return  # Bot can't delete messages
-        except TelegramBadRequest:
-            logger.warning(f'Cannot check bot permissions in chat {message.chat.id}')
-            return  # Can't check permissions
-
-        # Get banned emojis
-        banned_emojis = await self.storage.get_banned_emojis()
-        if not banned_emojis:
+        # Check if message contains banned emojis
+        banned_emojis = await self.storage.get_banned_emojis_set()
+        hits = banned_emojis.intersection(message.text)
+        if not hits:
             return
 
-        # Check if message contains banned emojis
-        found_banned_emojis = []
-        for char in message.text:
-            if char in banned_emojis:
-                found_banned_emojis.append(char)
+        # Check if bot has admin rights in this chat
+        if not await self._is_bot_admin(message.chat.id):
+            return  # Bot can't delete messages
 
-        if not found_banned_emojis:
-            return
+        found_banned_emojis = [char for char in message.text if char in hits]
 
         logger.info(f'Deleting message with banned emoji(s): {found_banned_emojis} from user {message.from_user.id}')
 
@@ -664,15 +779,11 @@ class AttendanceBot:
             'last_name': user.last_name or '',
             'username': f'@{user.username}' if user.username else ''
         }
-        await self.storage.update_poll_response(
-            rec['poll_id'], rec['user_id'], rec['option_ids'], rec['first_name'], rec['last_name'], rec['username']
-        )
-        for entry in self.scheduler.active_polls.values():
-            if entry['poll_id'] == poll_answer.poll_id:
-                responses = json.loads(entry['responses'])
-                responses.append(rec)
-                entry['responses'] = json.dumps(responses)
-                break
+        if not self.scheduler.add_response(rec['poll_id'], rec):
+            # poll is not tracked in memory - write straight to storage
+            await self.storage.update_poll_response(
+                rec['poll_id'], rec['user_id'], rec['option_ids'], rec['first_name'], rec['last_name'], rec['username']
+            )
 
     @staticmethod
     async def _on_error(update: Update, exception: Exception | None = None) -> None:
@@ -714,6 +825,7 @@ class AttendanceBot:
 
 
 if __name__ == '__main__':
+    load_dotenv()
     try:
         attendance_bot = AttendanceBot(Config.from_env())
         asyncio.run(attendance_bot.run())
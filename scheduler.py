@@ -4,6 +4,7 @@ import logging
 from typing import Any, Final
 
 import aiohttp
+import orjson
 from aiogram import Bot, exceptions
 from parser import ScheduleParser
 from storage import StorageManager
@@ -14,6 +15,7 @@ logger = logging.getLogger(__name__)
 
 class Scheduler:
     TIMEGROUPS_ENDPOINT: Final[str] = 'https://tulsu.ru/schedule/queries/GetTimeGroups.php'
+    RESPONSES_FLUSH_DELAY: Final[float] = 2.0
 
     def __init__(self, bot: Bot, config, storage: StorageManager, discipline_settings: tuple[list, dict, dict]):
         self.bot = bot
@@ -30,12 +32,17 @@ class Scheduler:
         self.session = aiohttp.ClientSession()
         self.parser = ScheduleParser(self.config, self.session, self.storage, self.discipline_settings)
         self.active_polls: dict[str, Any] = {}
+        self.polls_by_id: dict[str, Any] = {}  # poll_id -> active_polls entry
 
         self._semaphore = asyncio.Semaphore(3)
         self._running = False
         self.start_times: list[datetime.time] = []
         self._next_fetch: datetime.datetime | None = None
 
+        # poll answers arrive in bursts - persist them in batches
+        self._pending_writes: set[str] = set()  # poll_ids with unsaved responses
+        self._flush_task: asyncio.Task | None = None
+
     async def start(self) -> None:
         self._running = True
 
@@ -59,6 +66,7 @@ class Scheduler:
         try:
             rows = await self.storage.get_active_polls()
             self.active_polls.clear()
+            self.polls_by_id.clear()
             for poll_id, row in rows.items():
                 class_info = {
                     k: row[k] for k in
@@ -75,17 +83,26 @@ class Scheduler:
                 else:
                     close_time = raw_close
 
-                self.active_polls[key] = {
+                try:
+                    responses = orjson.loads(row.get('responses') or '[]')
+                except orjson.JSONDecodeError:
+                    logger.warning(f'Malformed responses in active poll {poll_id}, starting empty')
+                    responses = []
+
+                entry = {
                     'poll_id': row['poll_id'],
                     'message_id': row['message_id'],
                     'class_info': class_info,
                     'close_time': close_time,
-                    'responses': row.get('responses', '[]')
+                    'responses': responses
                 }
+                self.active_polls[key] = entry
+                self.polls_by_id[entry['poll_id']] = entry
             logger.info(f'Loaded {len(self.active_polls)} active polls from DB')
         except Exception as e:
             logger.error(f'Failed loading active polls: {e}')
             self.active_polls.clear()
+            self.polls_by_id.clear()
 
     @staticmethod
     def _generate_key(cls: dict[str, Any]) -> str:
@@ -189,14 +206,49 @@ class Scheduler:
                     'message_id': msg.message_id,
                     'class_info': cls,
                     'close_time': close_time,
-                    'responses': '[]'
+                    'responses': []
                 }
                 self.active_polls[key] = record
+                self.polls_by_id[record['poll_id']] = record
                 await self.storage.save_active_polls(record['poll_id'], record)
                 logger.info(f'Sent poll: {key}')
             except Exception as e:
                 logger.error(f'Error sending poll {key}: {e}')
 
+    def add_response(self, poll_id: str, rec: dict[str, Any]) -> bool:
+        entry = self.polls_by_id.get(poll_id)
+        if not entry:
+            return False
+
+        entry['responses'].append(rec)
+        self._pending_writes.add(poll_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+        return True
+
+    async def _flush_soon(self) -> None:
+        while self._pending_writes:
+            await asyncio.sleep(self.RESPONSES_FLUSH_DELAY)
+            await self.flush_responses()
+
+    async def flush_responses(self) -> bool:
+        batch = {
+            poll_id: self.polls_by_id[poll_id]['responses']
+            for poll_id in self._pending_writes if poll_id in self.polls_by_id
+        }
+        self._pending_writes.clear()
+        if not batch:
+            return True
+
+        try:
+            await self.storage.bulk_update_poll_responses(batch)
+            return True
+        except Exception as e:
+            logger.error(f'Failed saving poll responses: {e}')
+            self._pending_writes.update(batch)
+            return False
+
     def _calculate_close_time(self, cls: dict[str, Any]) -> datetime.datetime:
         date = datetime.datetime.strptime(cls['date'], '%d.%m.%Y').date()
         start = datetime.datetime.strptime(cls['start_time'], '%H:%M').time()
@@ -208,15 +260,36 @@ class Scheduler:
         return datetime.datetime.combine(date, datetime.time(23, 59))
 
     async def _close_expired_polls(self, now: datetime.datetime) -> None:
+        # archive must see every answer - retry closing on the next tick
+        if not await self.flush_responses():
+            return None
+
         expired_keys = []
         for key, info in list(self.active_polls.items()):
             if now >= info['close_time']:
+                poll_id = info['poll_id']
+
+                # from here on late answers go straight to storage via update_poll_response,
+                # so persist the in-memory list first to not overwrite them afterward.
+                # A poll already handed off on an earlier failed attempt must not be written again.
+                if self.polls_by_id.pop(poll_id, None) is not None:
+                    try:
+                        await self.storage.bulk_update_poll_responses({poll_id: info['responses']})
+                    except Exception as e:
+                        logger.error(f'Failed saving responses of poll {poll_id}, not closing it: {e}')
+                        self.polls_by_id[poll_id] = info
+                        continue
+
                 async with self._semaphore:
                     try:
-                        await self._close_poll(info)
-                    except exceptions.TelegramBadRequest:
-                        pass
-                    await self.storage.archive_poll(info['poll_id'])
+                        try:
+                            await self._close_poll(info)
+                        except exceptions.TelegramBadRequest:
+                            pass
+                        await self.storage.archive_poll(poll_id)
+                    except Exception as e:
+                        logger.error(f'Failed closing poll {poll_id}, retrying on next check: {e}')
+                        continue
 
                 expired_keys.append(key)
 
@@ -264,5 +337,10 @@ class Scheduler:
 
     async def close(self):
         self._running = False
+        if self._flush_task:
+            self._flush_task.cancel()
+            # a cancelled flush may have dropped its batch - persist everything held in memory
+            self._pending_writes.update(self.polls_by_id)
+        await self.flush_responses()
         await self.session.close()
         await self.storage.close()
@@ -1,10 +1,10 @@
 import logging
-import json
 import os
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable
 
 import aiosqlite
+import orjson
 
 
 logger = logging.getLogger(__name__)
@@ -20,6 +20,7 @@ class StorageManager:
 
     def __init__(self):
         self.conn: aiosqlite.Connection | None = None
+        self._banned_emojis_set: frozenset[str] | None = None
 
     async def connect(self):
         self.conn = await aiosqlite.connect(self.DB_FILE)
@@ -112,6 +113,21 @@ class StorageManager:
 
         return dict(row) if row else None
 
+    async def get_users(self, user_ids: Iterable[str]) -> dict[str, dict[str, Any]]:
+        assert self.conn
+
+        ids = list(set(user_ids))
+        if not ids:
+            return {}
+
+        placeholders = ','.join('?' for _ in ids)
+        async with self.conn.execute(
+            f'SELECT * FROM user_data WHERE user_id IN ({placeholders})', tuple(ids)
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+        return {row['user_id']: dict(row) for row in rows}
+
     async def update_user(self, user_id: str, data: dict[str, Any]) -> None:
         assert self.conn
 
@@ -167,7 +183,7 @@ class StorageManager:
                 class_info['room'],
                 class_info['class_type'],
                 data['close_time'],
-                data.get('responses', '[]')
+                orjson.dumps(data.get('responses', [])).decode()
             )
         )
 
@@ -191,8 +207,8 @@ class StorageManager:
         if not row:
             return None
         try:
-            responses = json.loads(row['responses'])
-        except json.JSONDecodeError:
+            responses = orjson.loads(row['responses'])
+        except orjson.JSONDecodeError:
             responses = []
 
         responses.append({
@@ -205,11 +221,21 @@ class StorageManager:
 
         await self.conn.execute(
             'UPDATE active_polls SET responses = ? WHERE poll_id = ?',
-            (json.dumps(responses, ensure_ascii=False), poll_id)
+            (orjson.dumps(responses).decode(), poll_id)
         )
 
         return await self.conn.commit()
 
+    async def bulk_update_poll_responses(self, batch: dict[str, list[dict[str, Any]]]) -> None:
+        assert self.conn
+
+        await self.conn.executemany(
+            'UPDATE active_polls SET responses = ? WHERE poll_id = ?',
+            [(orjson.dumps(responses).decode(), poll_id) for poll_id, responses in batch.items()]
+        )
+
+        await self.conn.commit()
+
     async def archive_poll(self, poll_id: str):
         assert self.conn
 
@@ -256,7 +282,7 @@ class StorageManager:
         end = f'{year + 1:04d}-01-01' if month == 12 else f'{year:04d}-{month + 1:02d}-01'
 
         query = '''
-            SELECT date, start_time, end_time, class_name, room, responses 
+            SELECT poll_id, date, start_time, end_time, class_name, prof, room, responses
             FROM past_polls
             WHERE close_time >= ? AND close_time < ?
             ORDER BY date, start_time
@@ -378,7 +404,7 @@ class StorageManager:
     async def save_last_schedule(self, group_id: int, raw_list: list[dict]) -> None:
         assert self.conn
 
-        raw_json = json.dumps(raw_list, ensure_ascii=False)
+        raw_json = orjson.dumps(raw_list).decode()
         await self.conn.execute('''
             INSERT INTO schedule_cache(group_id, raw_json)
             VALUES (?, ?)
@@ -401,8 +427,8 @@ class StorageManager:
             return []
 
         try:
-            return json.loads(row['raw_json'])
-        except json.JSONDecodeError:
+            return orjson.loads(row['raw_json'])
+        except orjson.JSONDecodeError:
             return []
 
     # ----- Banned emojis -----
@@ -415,6 +441,12 @@ class StorageManager:
 
         return [row['emoji'] for row in rows]
 
+    async def get_banned_emojis_set(self) -> frozenset[str]:
+        if self._banned_emojis_set is None:
+            self._banned_emojis_set = frozenset(await self.get_banned_emojis())
+
+        return self._banned_emojis_set
+
     async def add_banned_emoji(self, emoji: str, added_by: str) -> bool:
         assert self.conn
 
@@ -424,6 +456,7 @@ class StorageManager:
                 (emoji, added_by)
             )
             await self.conn.commit()
+            self._banned_emojis_set = None
             return True
         except aiosqlite.IntegrityError:
             # Emoji already exists
@@ -437,6 +470,7 @@ class StorageManager:
             (emoji,)
         )
         await self.conn.commit()
+        self._banned_emojis_set = None
         return result.rowcount > 0
 
     async def close(self):